@@ -3,36 +3,89 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import requests
-import asyncio
-import aiohttp
-from concurrent.futures import ProcessPoolExecutor
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import io
 from datetime import datetime
-from scipy import stats
-import statsmodels.api as sm
+from scipy.ndimage import uniform_filter1d
+
+_SEASON_BY_MONTH = np.array([
+    '',
+    'winter', 'winter',
+    'spring', 'spring', 'spring',
+    'summer', 'summer', 'summer',
+    'autumn', 'autumn', 'autumn',
+    'winter'
+])
+
+NUMBA_MIN_LENGTH = 1_000_000
 
 st.set_page_config(
     page_title="Анализ температурных данных",
     layout="wide"
 )
 
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(
+            total=3,
+            connect=1,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            raise_on_status=False
+        )
+    ))
+    return session
+
+_SESSION = get_http_session()
+
 st.title("Анализ климатических данных и мониторинг температуры")
 
 st.sidebar.header("Данные и настройки")
 
 uploaded_file = st.sidebar.file_uploader("Загрузите temperature_data.csv", type=["csv"])
 
+@st.cache_resource(max_entries=4)
+def load_data(_uploaded_file, data_key: str) -> pd.DataFrame:
+    data = pd.read_csv(
+        io.BytesIO(_uploaded_file.getvalue()),
+        parse_dates=['timestamp'],
+        index_col='timestamp'
+    )
+    data['temperature'] = data['temperature'].astype(np.float32)
+    data['city'] = data['city'].astype('category')
+    data['season'] = data['season'].astype('category')
+    return data
+
+@st.cache_resource(max_entries=4)
+def city_groups(_data: pd.DataFrame, data_key: str) -> dict:
+    return {city: frame.sort_index() for city, frame in _data.groupby('city', sort=False, observed=True)}
+
+@st.cache_resource(max_entries=4)
+def seasonal_table(_data: pd.DataFrame, data_key: str) -> pd.DataFrame:
+    temperature = _data['temperature'].astype(np.float64)
+    return temperature.groupby(
+        [_data['city'], _data['season']], observed=True
+    ).agg(['mean', 'std'])
+
+@st.cache_resource(max_entries=4)
+def get_city_list(_data: pd.DataFrame, data_key: str) -> list:
+    return sorted(_data['city'].cat.categories.tolist())
+
 if uploaded_file is not None:
-    data = pd.read_csv(uploaded_file)
-    data['timestamp'] = pd.to_datetime(data['timestamp'])
-    data.set_index('timestamp', inplace=True)
+    data_key = uploaded_file.file_id
+    data = load_data(uploaded_file, data_key)
 else:
     st.warning("Загрузите файл с данными")
     st.stop()
 
-city_list = sorted(data['city'].unique())
+city_list = get_city_list(data, data_key)
 selected_city = st.sidebar.selectbox("Выберите город", city_list)
 
 api_key = st.sidebar.text_input("OpenWeatherMap API Key", type="password")
@@ -40,34 +93,117 @@ api_key = st.sidebar.text_input("OpenWeatherMap API Key", type="password")
 enable_parallel = st.sidebar.checkbox("Включить параллельную обработку", value=False)
 window_size = st.sidebar.slider("Размер окна для скользящего среднего", 7, 90, 30)
 
-def calculate_moving_statistics(city_data, window=30):
-    city_data = city_data.sort_index().copy()
-    
-    city_data['rolling_mean'] = city_data['temperature'].rolling(
+def rolling_window_counts(length, window):
+    positions = np.arange(length)
+    offset = (window - 1) // 2
+    end = np.minimum(positions + offset + 1, length)
+    start = np.maximum(positions + offset + 1 - window, 0)
+    return end - start
+
+def rolling_mean_std_pandas(values, window):
+    temperature = pd.Series(values)
+    rolling_mean = temperature.rolling(
+        window=window, center=True, min_periods=1
+    ).mean().values
+    rolling_mean_sq = (temperature * temperature).rolling(
         window=window, center=True, min_periods=1
-    ).mean()
+    ).mean().values
     
-    city_data['rolling_std'] = city_data['temperature'].rolling(
+    counts = temperature.rolling(
         window=window, center=True, min_periods=1
-    ).std()
+    ).count().values
+    variance = np.clip(rolling_mean_sq - rolling_mean * rolling_mean, 0, None)
+    variance = np.where(counts > 1, variance * counts / np.maximum(counts - 1, 1), np.nan)
+    return rolling_mean, np.sqrt(variance)
+
+def rolling_mean_std_uniform_filter(values, window):
+    counts = rolling_window_counts(len(values), window)
+    scale = window / counts
+    rolling_mean = uniform_filter1d(values, size=window, mode='constant') * scale
+    rolling_mean_sq = uniform_filter1d(values * values, size=window, mode='constant') * scale
+    
+    variance = np.clip(rolling_mean_sq - rolling_mean * rolling_mean, 0, None)
+    variance = np.where(counts > 1, variance * counts / np.maximum(counts - 1, 1), np.nan)
+    return rolling_mean, np.sqrt(variance)
+
+@st.cache_resource
+def get_numba_kernel():
+    try:
+        import numba
+    except ImportError:
+        return None
     
-    city_data['upper_bound'] = city_data['rolling_mean'] + 2 * city_data['rolling_std']
-    city_data['lower_bound'] = city_data['rolling_mean'] - 2 * city_data['rolling_std']
+    @numba.njit(cache=True)
+    def rolling_mean_std_numba(values, window):
+        length = values.shape[0]
+        offset = (window - 1) // 2
+        rolling_mean = np.empty(length)
+        rolling_std = np.empty(length)
+        total = 0.0
+        total_sq = 0.0
+        start = 0
+        end = 0
+        for i in range(length):
+            window_end = min(i + offset + 1, length)
+            window_start = max(i + offset + 1 - window, 0)
+            while end < window_end:
+                total += values[end]
+                total_sq += values[end] * values[end]
+                end += 1
+            while start < window_start:
+                total -= values[start]
+                total_sq -= values[start] * values[start]
+                start += 1
+            count = end - start
+            mean = total / count
+            rolling_mean[i] = mean
+            if count > 1:
+                variance = (total_sq - count * mean * mean) / (count - 1)
+                rolling_std[i] = np.sqrt(variance) if variance > 0 else 0.0
+            else:
+                rolling_std[i] = np.nan
+        return rolling_mean, rolling_std
     
-    return city_data
+    return rolling_mean_std_numba
 
-def detect_anomalies(city_data):
-    city_data = city_data.copy()
-    city_data['anomaly'] = (
-        (city_data['temperature'] > city_data['upper_bound']) |
-        (city_data['temperature'] < city_data['lower_bound'])
+@st.cache_resource(max_entries=32)
+def calculate_moving_statistics(_city_data, city, window, data_key):
+    values = _city_data['temperature'].to_numpy(dtype=np.float64)
+    numba_kernel = get_numba_kernel() if len(values) >= NUMBA_MIN_LENGTH else None
+    if np.isnan(values).any():
+        rolling_mean, rolling_std = rolling_mean_std_pandas(values, window)
+    elif numba_kernel is not None:
+        rolling_mean, rolling_std = numba_kernel(values, window)
+    else:
+        rolling_mean, rolling_std = rolling_mean_std_uniform_filter(values, window)
+    
+    return _city_data.assign(
+        rolling_mean=rolling_mean,
+        rolling_std=rolling_std,
+        upper_bound=np.add(rolling_mean, 2 * rolling_std),
+        lower_bound=np.subtract(rolling_mean, 2 * rolling_std)
     )
-    return city_data
 
-def get_current_weather_sync(city_name, api_key):
-    if not api_key:
-        return None, "API ключ не указан"
-    
+@st.cache_resource(max_entries=32)
+def calculate_seasonal_stats(_city_data, city, data_key):
+    temperature = _city_data['temperature'].astype(np.float64)
+    return temperature.groupby(_city_data['season'], observed=True).agg(
+        temperature_mean='mean',
+        temperature_std='std',
+        temperature_min='min',
+        temperature_max='max',
+        temperature_count='count'
+    ).round(2).reset_index()
+
+def detect_anomalies(city_data):
+    temperature = city_data['temperature'].values
+    upper_bound = city_data['upper_bound'].values
+    lower_bound = city_data['lower_bound'].values
+    anomaly = np.logical_or(temperature > upper_bound, temperature < lower_bound)
+    return city_data.assign(anomaly=anomaly)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_current_weather(city_name, api_key):
     url = "http://api.openweathermap.org/data/2.5/weather"
     params = {
         'q': city_name,
@@ -76,120 +212,193 @@ def get_current_weather_sync(city_name, api_key):
         'lang': 'ru'
     }
     
+    response = _SESSION.get(url, params=params, timeout=10)
+    response.raise_for_status()
+    
+    weather_data = response.json()
+    return {
+        'temperature': weather_data['main']['temp'],
+        'description': weather_data['weather'][0]['description'],
+        'city': weather_data['name'],
+        'country': weather_data['sys']['country']
+    }
+
+def get_current_weather_sync(city_name, api_key):
+    if not api_key:
+        return None, "API ключ не указан"
+    
     try:
-        response = requests.get(url, params=params, timeout=10)
-        
-        if response.status_code == 200:
-            weather_data = response.json()
-            return {
-                'temperature': weather_data['main']['temp'],
-                'description': weather_data['weather'][0]['description'],
-                'city': weather_data['name'],
-                'country': weather_data['sys']['country']
-            }, None
-        elif response.status_code == 401:
+        return fetch_current_weather(city_name, api_key), None
+    except requests.HTTPError as e:
+        if e.response.status_code == 401:
             return None, "Неверный API ключ"
         else:
-            return None, f"Ошибка: {response.status_code}"
+            return None, f"Ошибка: {e.response.status_code}"
     except:
         return None, "Ошибка подключения"
 
-st.header(f"Анализ данных для {selected_city}")
+def downsample(frame, max_points=2000):
+    stride = max(1, int(np.ceil(len(frame) / max_points)))
+    return frame.iloc[::stride]
 
-city_data = data[data['city'] == selected_city].copy()
-
-tab1, tab2, tab3, tab4 = st.tabs([
-    "Временной ряд", 
-    "Аномалии", 
-    "Текущая погода", 
-    "Статистика"
-])
-
-with tab1:
-    st.subheader("Временной ряд температуры")
-    
-    city_data_with_stats = calculate_moving_statistics(city_data, window_size)
+@st.cache_resource(max_entries=32)
+def build_timeseries_figure(_city_data_with_stats, city, window, data_key):
+    plot_data = downsample(_city_data_with_stats)
     
     fig = go.Figure()
     
-    fig.add_trace(go.Scatter(
-        x=city_data_with_stats.index,
-        y=city_data_with_stats['temperature'],
+    fig.add_trace(go.Scattergl(
+        x=plot_data.index,
+        y=plot_data['temperature'],
         mode='lines',
         name='Температура',
         line=dict(color='lightblue', width=1)
     ))
     
-    fig.add_trace(go.Scatter(
-        x=city_data_with_stats.index,
-        y=city_data_with_stats['rolling_mean'],
+    fig.add_trace(go.Scattergl(
+        x=plot_data.index,
+        y=plot_data['rolling_mean'],
         mode='lines',
-        name=f'Скользящее среднее ({window_size} дней)',
+        name=f'Скользящее среднее ({window} дней)',
         line=dict(color='red', width=2)
     ))
     
-    fig.add_trace(go.Scatter(
-        x=city_data_with_stats.index.tolist() + city_data_with_stats.index.tolist()[::-1],
-        y=city_data_with_stats['upper_bound'].tolist() + city_data_with_stats['lower_bound'].tolist()[::-1],
-        fill='toself',
+    fig.add_trace(go.Scattergl(
+        x=plot_data.index,
+        y=plot_data['upper_bound'],
+        mode='lines',
+        line=dict(color='rgba(255,255,255,0)'),
+        showlegend=False,
+        hoverinfo='skip'
+    ))
+    
+    fig.add_trace(go.Scattergl(
+        x=plot_data.index,
+        y=plot_data['lower_bound'],
+        mode='lines',
+        fill='tonexty',
         fillcolor='rgba(255, 0, 0, 0.1)',
         line=dict(color='rgba(255,255,255,0)'),
         name='Диапазон ±2σ'
     ))
     
     fig.update_layout(
-        title=f'Температурный ряд: {selected_city}',
+        title=f'Температурный ряд: {city}',
         xaxis_title='Дата',
         yaxis_title='Температура (°C)',
         height=500,
         hovermode='x unified'
     )
     
-    st.plotly_chart(fig, use_container_width=True)
-    
-    col1, col2, col3, col4 = st.columns(4)
-    with col1:
-        st.metric("Средняя температура", f"{city_data['temperature'].mean():.1f}°C")
-    with col2:
-        st.metric("Максимальная", f"{city_data['temperature'].max():.1f}°C")
-    with col3:
-        st.metric("Минимальная", f"{city_data['temperature'].min():.1f}°C")
-    with col4:
-        st.metric("Стандартное отклонение", f"{city_data['temperature'].std():.1f}°C")
+    return fig
 
-with tab2:
-    st.subheader("Температурные аномалии")
+@st.cache_resource(max_entries=32)
+def build_anomaly_figure(_city_data_with_anomalies, city, window, data_key):
+    dates = _city_data_with_anomalies.index.values
+    temperatures = _city_data_with_anomalies['temperature'].values
+    anomaly_mask = _city_data_with_anomalies['anomaly'].values
     
-    city_data_with_anomalies = detect_anomalies(city_data_with_stats)
-    anomaly_count = city_data_with_anomalies['anomaly'].sum()
-    
-    fig2 = go.Figure()
+    fig = go.Figure()
     
-    normal_data = city_data_with_anomalies[~city_data_with_anomalies['anomaly']]
-    fig2.add_trace(go.Scatter(
-        x=normal_data.index,
-        y=normal_data['temperature'],
+    fig.add_trace(go.Scattergl(
+        x=dates[~anomaly_mask],
+        y=temperatures[~anomaly_mask],
         mode='markers',
         name='Нормальная температура',
         marker=dict(color='blue', size=3, opacity=0.3)
     ))
     
-    anomaly_data = city_data_with_anomalies[city_data_with_anomalies['anomaly']]
-    fig2.add_trace(go.Scatter(
-        x=anomaly_data.index,
-        y=anomaly_data['temperature'],
+    fig.add_trace(go.Scattergl(
+        x=dates[anomaly_mask],
+        y=temperatures[anomaly_mask],
         mode='markers',
         name='Аномалии',
         marker=dict(color='red', size=6, symbol='diamond')
     ))
     
-    fig2.update_layout(
-        title=f'Температурные аномалии: {selected_city}',
+    fig.update_layout(
+        title=f'Температурные аномалии: {city}',
         xaxis_title='Дата',
         yaxis_title='Температура (°C)',
         height=500
     )
     
+    return fig
+
+@st.cache_resource(max_entries=32)
+def build_seasonal_figure(_seasonal_stats, city, data_key):
+    fig = go.Figure()
+    
+    season_order = ['winter', 'spring', 'summer', 'autumn']
+    seasonal_stats_ordered = _seasonal_stats.set_index('season').reindex(season_order).reset_index()
+    
+    fig.add_trace(go.Bar(
+        x=seasonal_stats_ordered['season'],
+        y=seasonal_stats_ordered['temperature_mean'],
+        error_y=dict(
+            type='data',
+            array=seasonal_stats_ordered['temperature_std'],
+            visible=True
+        ),
+        name='Средняя температура ± σ',
+        marker_color=['#3498db', '#2ecc71', '#e74c3c', '#f39c12']
+    ))
+    
+    fig.update_layout(
+        title=f'Сезонный температурный профиль: {city}',
+        xaxis_title='Сезон',
+        yaxis_title='Температура (°C)',
+        height=400
+    )
+    
+    return fig
+
+st.header(f"Анализ данных для {selected_city}")
+
+city_data = city_groups(data, data_key)[selected_city]
+
+tab1, tab2, tab3, tab4 = st.tabs([
+    "Временной ряд", 
+    "Аномалии", 
+    "Текущая погода", 
+    "Статистика"
+])
+
+with tab1:
+    st.subheader("Временной ряд температуры")
+    
+    city_data_with_stats = calculate_moving_statistics(
+        city_data, selected_city, window_size, data_key
+    )
+    
+    fig = build_timeseries_figure(
+        city_data_with_stats, selected_city, window_size, data_key
+    )
+    
+    st.plotly_chart(fig, use_container_width=True)
+    
+    temperature_summary = city_data['temperature'].agg(['mean', 'max', 'min', 'std'])
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Средняя температура", f"{temperature_summary['mean']:.1f}°C")
+    with col2:
+        st.metric("Максимальная", f"{temperature_summary['max']:.1f}°C")
+    with col3:
+        st.metric("Минимальная", f"{temperature_summary['min']:.1f}°C")
+    with col4:
+        st.metric("Стандартное отклонение", f"{temperature_summary['std']:.1f}°C")
+
+with tab2:
+    st.subheader("Температурные аномалии")
+    
+    city_data_with_anomalies = detect_anomalies(city_data_with_stats)
+    anomaly_count = city_data_with_anomalies['anomaly'].sum()
+    
+    fig2 = build_anomaly_figure(
+        city_data_with_anomalies, selected_city, window_size, data_key
+    )
+    
     st.plotly_chart(fig2, use_container_width=True)
     
     col1, col2, col3 = st.columns(3)
@@ -219,20 +428,12 @@ with tab3:
                         st.write(f"Город: {weather_data['city']}, {weather_data['country']}")
                     
                     with col2:
-                        current_month = datetime.now().month
-                        month_to_season = {
-                            12: "winter", 1: "winter", 2: "winter",
-                            3: "spring", 4: "spring", 5: "spring",
-                            6: "summer", 7: "summer", 8: "summer",
-                            9: "autumn", 10: "autumn", 11: "autumn"
-                        }
-                        current_season = month_to_season.get(current_month, "unknown")
+                        current_season = _SEASON_BY_MONTH[datetime.now().month]
                         
-                        season_data = city_data[city_data['season'] == current_season]
+                        seasonal_means = seasonal_table(data, data_key)
                         
-                        if len(season_data) > 0:
-                            mean_temp = season_data['temperature'].mean()
-                            std_temp = season_data['temperature'].std()
+                        if (selected_city, current_season) in seasonal_means.index:
+                            mean_temp, std_temp = seasonal_means.loc[(selected_city, current_season)]
                             lower_bound = mean_temp - 2 * std_temp
                             upper_bound = mean_temp + 2 * std_temp
                             
@@ -252,38 +453,11 @@ with tab3:
 with tab4:
     st.subheader("Статистика по сезонам")
     
-    seasonal_stats = city_data.groupby('season').agg({
-        'temperature': ['mean', 'std', 'min', 'max', 'count']
-    }).round(2)
-    
-    seasonal_stats.columns = ['_'.join(col).strip() for col in seasonal_stats.columns.values]
-    seasonal_stats = seasonal_stats.reset_index()
+    seasonal_stats = calculate_seasonal_stats(city_data, selected_city, data_key)
     
     st.dataframe(seasonal_stats)
     
-    fig3 = go.Figure()
-    
-    season_order = ['winter', 'spring', 'summer', 'autumn']
-    seasonal_stats_ordered = seasonal_stats.set_index('season').reindex(season_order).reset_index()
-    
-    fig3.add_trace(go.Bar(
-        x=seasonal_stats_ordered['season'],
-        y=seasonal_stats_ordered['temperature_mean'],
-        error_y=dict(
-            type='data',
-            array=seasonal_stats_ordered['temperature_std'],
-            visible=True
-        ),
-        name='Средняя температура ± σ',
-        marker_color=['#3498db', '#2ecc71', '#e74c3c', '#f39c12']
-    ))
-    
-    fig3.update_layout(
-        title=f'Сезонный температурный профиль: {selected_city}',
-        xaxis_title='Сезон',
-        yaxis_title='Температура (°C)',
-        height=400
-    )
+    fig3 = build_seasonal_figure(seasonal_stats, selected_city, data_key)
     
     st.plotly_chart(fig3, use_container_width=True)
 